@@ -1,5 +1,12 @@
+import os
 from collections import Counter
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+from models import db, Requirement, PlanVersion, PlanPhase
+from plan_parser import PHASE_KEYWORDS
+
+# USD per 1K tokens for plan generation (defaults are GPT-4 list prices)
+PROMPT_COST_PER_1K = float(os.environ.get('PLAN_PROMPT_COST_PER_1K', 0.03))
+COMPLETION_COST_PER_1K = float(os.environ.get('PLAN_COMPLETION_COST_PER_1K', 0.06))
 
 def analyze_modules(requirements: List[Any]) -> Dict:
     """Analyze module usage patterns"""
@@ -61,3 +68,60 @@ def get_requirements_stats(requirements: List[Any]) -> Dict:
         'avg_complexity': avg_complexity,
         'common_type': common_type.replace('_', ' ').title()
     }
+
+def analyze_token_usage() -> List[Dict]:
+    """Cost and latency of every GPT plan generation, grouped by completion token budget"""
+    rows = (db.session.query(PlanVersion.max_tokens,
+                             db.func.count(PlanVersion.id).label('plans'),
+                             db.func.coalesce(db.func.sum(PlanVersion.prompt_tokens), 0).label('prompt_tokens'),
+                             db.func.coalesce(db.func.sum(PlanVersion.completion_tokens), 0).label('completion_tokens'),
+                             db.func.coalesce(db.func.sum(PlanVersion.latency_ms), 0).label('latency_ms'))
+            # Basic (fallback) plans and plans generated before usage tracking have no token budget
+            .filter(PlanVersion.max_tokens.isnot(None))
+            .group_by(PlanVersion.max_tokens)
+            .order_by(PlanVersion.max_tokens)
+            .all())
+
+    report = []
+    for row in rows:
+        cost = (row.prompt_tokens / 1000 * PROMPT_COST_PER_1K +
+                row.completion_tokens / 1000 * COMPLETION_COST_PER_1K)
+        report.append({
+            'max_tokens': row.max_tokens,
+            'plans': row.plans,
+            'avg_prompt_tokens': round(row.prompt_tokens / row.plans),
+            'avg_completion_tokens': round(row.completion_tokens / row.plans),
+            'avg_latency_s': round(row.latency_ms / row.plans / 1000, 1),
+            'total_cost': round(cost, 2),
+            'avg_cost': round(cost / row.plans, 3)
+        })
+    return report
+
+def analyze_phase_durations() -> Dict:
+    """Average planned duration (weeks) of each phase across indexed plans"""
+    rows = dict(db.session.query(PlanPhase.phase_key, db.func.avg(PlanPhase.duration_weeks))
+                .filter(PlanPhase.duration_weeks.isnot(None))
+                .group_by(PlanPhase.phase_key).all())
+    keys = [key for key, _ in PHASE_KEYWORDS]
+    return {
+        'labels': [key.replace('_', ' ').title() for key in keys],
+        'values': [round(rows.get(key) or 0, 1) for key in keys]
+    }
+
+def find_plans_by_phase_duration(phase_key: str, min_weeks: float, user_id: Optional[int] = None) -> List[Dict]:
+    """
+    Requirements whose plan gives the phase a duration longer than min_weeks,
+    limited to one user's requirements when user_id is given
+    """
+    query = (db.session.query(Requirement.id, Requirement.user_id, Requirement.project_scope, PlanPhase.duration_weeks)
+             .join(PlanPhase, PlanPhase.requirement_id == Requirement.id)
+             .filter(PlanPhase.phase_key == phase_key, PlanPhase.duration_weeks > min_weeks))
+    if user_id is not None:
+        query = query.filter(Requirement.user_id == user_id)
+    rows = query.order_by(PlanPhase.duration_weeks.desc()).all()
+    return [{
+        'id': row.id,
+        'user_id': row.user_id,
+        'project_scope': row.project_scope,
+        'duration_weeks': row.duration_weeks
+    } for row in rows]
@@ -1,16 +1,23 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash
+import uuid
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, make_response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf import FlaskForm, CSRFProtect
-from wtforms import StringField, TextAreaField, SelectField, PasswordField, EmailField, validators
+from wtforms import StringField, TextAreaField, SelectField, PasswordField, EmailField, HiddenField, validators
+from sqlalchemy.exc import IntegrityError
 from functools import wraps
 from requirements_analyzer import analyze_requirements
 from plan_generator import generate_plan
-from analytics import analyze_modules, analyze_complexity, get_requirements_stats
+from analytics import (analyze_modules, analyze_complexity, get_requirements_stats, analyze_token_usage,
+                       analyze_phase_durations, find_plans_by_phase_duration)
 from datetime import datetime
-from models import db, User, Requirement, Comment
+from models import db, User, Requirement, Comment, PlanVersion, PlanSection, PlanPhase, upgrade_schema
 from flask_cors import CORS
+from rate_limiter import AdmissionController, create_store
+from plan_regeneration import select_requirements, regenerate_plans
+from assets import init_assets
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY") or "a secret key"
@@ -20,6 +27,13 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
 }
 
+# Admission control for plan-generating routes (burst size and refill rate per minute)
+app.config['RATE_LIMIT_STORAGE'] = os.environ.get('RATE_LIMIT_STORAGE', 'database')
+app.config['PLAN_USER_BURST'] = int(os.environ.get('PLAN_USER_BURST', 3))
+app.config['PLAN_USER_PER_MINUTE'] = float(os.environ.get('PLAN_USER_PER_MINUTE', 2))
+app.config['PLAN_GLOBAL_BURST'] = int(os.environ.get('PLAN_GLOBAL_BURST', 20))
+app.config['PLAN_GLOBAL_PER_MINUTE'] = float(os.environ.get('PLAN_GLOBAL_PER_MINUTE', 30))
+
 # Initialize CSRF protection
 csrf = CSRFProtect(app)
 app.config['WTF_CSRF_CHECK_DEFAULT'] = False  # Disable CSRF by default
@@ -34,11 +48,22 @@ CORS(app, supports_credentials=True, resources={
     }
 })
 
+# Fingerprinted static assets built by build_assets.py
+init_assets(app)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 db.init_app(app)
 
+plan_admission = AdmissionController(
+    create_store(app.config['RATE_LIMIT_STORAGE']),
+    user_capacity=app.config['PLAN_USER_BURST'],
+    user_per_minute=app.config['PLAN_USER_PER_MINUTE'],
+    global_capacity=app.config['PLAN_GLOBAL_BURST'],
+    global_per_minute=app.config['PLAN_GLOBAL_PER_MINUTE']
+)
+
 # Form classes
 class AdminLoginForm(FlaskForm):
     username = StringField('Username', validators=[validators.DataRequired()])
@@ -79,6 +104,7 @@ class RequirementForm(FlaskForm):
     modules_involved = StringField('Modules Involved', validators=[validators.DataRequired()])
     functional_requirements = TextAreaField('Functional Requirements', validators=[validators.DataRequired()])
     technical_constraints = TextAreaField('Technical Constraints')
+    idempotency_key = HiddenField('Idempotency Key')
 
 def admin_required(f):
     @wraps(f)
@@ -89,6 +115,35 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def plan_admission_throttled():
+    """Take a plan-generation token for the current user; returns a 429 response if none is available"""
+    retry_after = plan_admission.admit(current_user.id)
+    if retry_after is None:
+        return None
+    response = make_response(render_template('rate_limited.html', retry_after=retry_after), 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def resubmitted_requirement(requirement):
+    """Redirect a resubmitted form to the requirement it already created"""
+    if requirement.user_id != current_user.id:
+        flash('Unauthorized access')
+        return redirect(url_for('dashboard'))
+    if requirement.generation_state == 'generating':
+        flash('This requirement is already being processed')
+    return redirect(url_for('plan_review', req_id=requirement.id))
+
+def mark_generation_failed(requirement):
+    """Record a failed generation so the form can be retried and the plan regenerated"""
+    if requirement is None or not db.inspect(requirement).persistent:
+        return
+    try:
+        requirement.generation_status = 'failed'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error marking plan generation failed: {str(e)}")
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -157,6 +212,9 @@ def delete_user(user_id):
     
     try:
         Comment.query.filter_by(user_id=user.id).delete()
+        requirement_ids = db.session.query(Requirement.id).filter_by(user_id=user.id)
+        for model in (PlanVersion, PlanSection, PlanPhase):
+            model.query.filter(model.requirement_id.in_(requirement_ids)).delete(synchronize_session=False)
         Requirement.query.filter_by(user_id=user.id).delete()
         db.session.delete(user)
         db.session.commit()
@@ -227,39 +285,89 @@ def analytics():
     module_stats = analyze_modules(requirements)
     complexity_stats = analyze_complexity(requirements)
     stats = get_requirements_stats(requirements)
+    token_usage = analyze_token_usage()
+    phase_stats = analyze_phase_durations()
+    
+    phase = request.args.get('phase', 'testing')
+    min_weeks = request.args.get('min_weeks', 4, type=float)
+    # Other users' project scopes are only listed for admins
+    long_phase_plans = find_plans_by_phase_duration(phase, min_weeks,
+                                                    user_id=None if current_user.is_admin else current_user.id)
     
     return render_template('analytics.html',
                          module_stats=module_stats,
                          complexity_stats=complexity_stats,
-                         stats=stats)
+                         stats=stats,
+                         token_usage=token_usage,
+                         phase_stats=phase_stats,
+                         phase=phase,
+                         min_weeks=min_weeks,
+                         long_phase_plans=long_phase_plans)
 
 @app.route('/requirement/new', methods=['GET', 'POST'])
 @login_required
 def new_requirement():
     form = RequirementForm()
     if form.validate_on_submit():
+        key = form.idempotency_key.data or None
+        existing = Requirement.query.filter_by(idempotency_key=key).first() if key else None
+        if existing and (existing.user_id != current_user.id or existing.generation_state != 'failed'):
+            return resubmitted_requirement(existing)
+
+        # Only requests that will call the API spend a token
+        throttled = plan_admission_throttled()
+        if throttled:
+            return throttled
+
+        requirement = None
         try:
-            requirement = Requirement(
-                user_id=current_user.id,
-                project_scope=form.project_scope.data.strip(),
-                customization_type=form.customization_type.data,
-                modules_involved=form.modules_involved.data.strip(),
-                functional_requirements=form.functional_requirements.data.strip(),
-                technical_constraints=form.technical_constraints.data.strip() if form.technical_constraints.data else ''
-            )
+            if existing:
+                # Retry a failed generation, claiming the row so a concurrent retry cannot also start
+                claimed = (Requirement.query.filter_by(id=existing.id)
+                           .filter(Requirement.generation_failed_clause())
+                           .update({'generation_status': 'generating', 'generation_started_at': datetime.utcnow()},
+                                   synchronize_session=False))
+                db.session.commit()
+                if not claimed:
+                    return resubmitted_requirement(existing)
+                requirement = Requirement.query.get(existing.id)
+            else:
+                requirement = Requirement(
+                    user_id=current_user.id,
+                    idempotency_key=key,
+                    generation_status='generating',
+                    generation_started_at=datetime.utcnow()
+                )
+            
+            requirement.project_scope = form.project_scope.data.strip()
+            requirement.customization_type = form.customization_type.data
+            requirement.modules_involved = form.modules_involved.data.strip()
+            requirement.functional_requirements = form.functional_requirements.data.strip()
+            requirement.technical_constraints = form.technical_constraints.data.strip() if form.technical_constraints.data else ''
             
             analysis = analyze_requirements(requirement)
             requirement.complexity = analysis['complexity']
             
+            # Save before generating so a resubmitted form finds the in-flight requirement
+            db.session.add(requirement)
             try:
-                plan = generate_plan(analysis)
-                requirement.implementation_plan = plan
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return resubmitted_requirement(Requirement.query.filter_by(idempotency_key=key).first_or_404())
+            
+            try:
+                usage = {}
+                plan = generate_plan(analysis, usage=usage)
+                requirement.apply_plan(plan, usage)
             except Exception as e:
                 app.logger.error(f"Error generating plan: {str(e)}")
+                db.session.rollback()
+                mark_generation_failed(requirement)
                 flash('Error generating implementation plan. Please try again.')
-                return redirect(url_for('new_requirement'))
+                # Re-render with the submitted data and idempotency key so resubmitting retries this requirement
+                return render_template('requirement_form.html', form=form)
             
-            db.session.add(requirement)
             db.session.commit()
             
             flash('Requirement submitted successfully')
@@ -268,21 +376,33 @@ def new_requirement():
         except Exception as e:
             app.logger.error(f"Error saving requirement: {str(e)}")
             db.session.rollback()
+            mark_generation_failed(requirement)
             flash('Error saving requirement. Please try again.')
-            return redirect(url_for('new_requirement'))
-            
+            return render_template('requirement_form.html', form=form)
+    
+    if not form.idempotency_key.data:
+        form.idempotency_key.data = uuid.uuid4().hex
     return render_template('requirement_form.html', form=form)
 
 @app.route('/plan/<int:req_id>')
 @login_required
 def plan_review(req_id):
-    requirement = Requirement.query.get_or_404(req_id)
+    # The full plan text is only loaded for plans that have not been indexed into sections
+    requirement = Requirement.query.options(db.defer(Requirement.implementation_plan)).filter_by(id=req_id).first_or_404()
     if requirement.user_id != current_user.id and not current_user.is_admin:
         flash('Unauthorized access')
         return redirect(url_for('dashboard'))
     form = FlaskForm()
     return render_template('plan_review.html', requirement=requirement, form=form)
 
+@app.route('/plan/<int:req_id>/section/<int:section_id>')
+@login_required
+def plan_section(req_id, section_id):
+    section = PlanSection.query.filter_by(id=section_id, requirement_id=req_id).first_or_404()
+    if section.requirement.user_id != current_user.id and not current_user.is_admin:
+        return 'Unauthorized access', 403
+    return render_template('plan_section.html', section=section)
+
 @app.route('/requirement/<int:req_id>/delete')
 @login_required
 def delete_requirement(req_id):
@@ -335,8 +455,57 @@ def update_progress(req_id):
         flash('Invalid form submission')
     return redirect(url_for('plan_review', req_id=req_id))
 
+@app.route('/plan/<int:req_id>/version/<int:version_id>')
+@login_required
+def plan_version(req_id, version_id):
+    requirement = Requirement.query.get_or_404(req_id)
+    if requirement.user_id != current_user.id and not current_user.is_admin:
+        flash('Unauthorized access')
+        return redirect(url_for('dashboard'))
+    version = requirement.plan_versions.filter_by(id=version_id).first_or_404()
+    return render_template('plan_version.html', requirement=requirement, version=version)
+
+@app.cli.command('regenerate-plans')
+@click.option('--all', 'regenerate_all', is_flag=True, help='Include plans already on the current prompt version and model.')
+@click.option('--user-id', type=int, help='Only requirements submitted by this user.')
+@click.option('--complexity', type=click.Choice(['low', 'medium', 'high']), help='Only requirements of this complexity.')
+@click.option('--since', type=click.DateTime(), help='Only requirements created on or after this date.')
+@click.option('--id', 'ids', type=int, multiple=True, help='Only these requirement ids (repeatable).')
+@click.option('--limit', type=int, help='Regenerate at most this many requirements.')
+@click.option('--concurrency', type=int, default=4, show_default=True, help='Maximum concurrent GPT requests.')
+@click.option('--checkpoint', default='regenerate_plans.checkpoint.json', show_default=True, help='Checkpoint file used to resume a partial run.')
+@click.option('--dry-run', is_flag=True, help='List the matching requirements without regenerating.')
+def regenerate_plans_command(regenerate_all, user_id, complexity, since, ids, limit, concurrency, checkpoint, dry_run):
+    """Regenerate implementation plans, e.g. after the GPT prompt or model changes."""
+    requirements = select_requirements(stale_only=not regenerate_all, user_id=user_id, complexity=complexity,
+                                       since=since, ids=list(ids), limit=limit)
+    if dry_run:
+        for requirement in requirements:
+            click.echo(f"{requirement.id}\tprompt v{requirement.plan_prompt_version or '-'}\t{requirement.plan_model or 'basic'}")
+        click.echo(f"{len(requirements)} requirement(s) match")
+        return
+
+    result = regenerate_plans(requirements, concurrency=concurrency, checkpoint_path=checkpoint, log=click.echo)
+    click.echo(f"Done: {len(result['completed'])} regenerated, {len(result['failed'])} failed. "
+               f"Re-run the same command to retry failures.")
+
+@app.cli.command('index-plans')
+@click.option('--all', 'reindex_all', is_flag=True, help='Re-parse plans that are already indexed.')
+def index_plans_command(reindex_all):
+    """Parse stored plans into sections and phases."""
+    query = Requirement.query.filter(Requirement.implementation_plan.isnot(None))
+    if not reindex_all:
+        query = query.filter(~Requirement.plan_sections.any())
+    ids = [row.id for row in query.with_entities(Requirement.id)]
+    for start in range(0, len(ids), 100):
+        for requirement in Requirement.query.filter(Requirement.id.in_(ids[start:start + 100])):
+            requirement.index_plan()
+        db.session.commit()
+    click.echo(f"Indexed {len(ids)} plan(s)")
+
 with app.app_context():
     db.create_all()
+    upgrade_schema()
     
     # Create initial admin user if none exists
     admin = User.query.filter_by(username='admin').first()
@@ -0,0 +1,56 @@
+import json
+import mimetypes
+import os
+from flask import current_app, request, send_from_directory, url_for, abort
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Precompressed variants in order of preference: (Accept-Encoding token, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+def load_manifest() -> dict:
+    """Map of source path (e.g. 'css/custom.css') to fingerprinted path in static/dist"""
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+def asset_url(path: str) -> str:
+    """URL for a static asset: the fingerprinted build if one exists, otherwise the unbuilt file"""
+    manifest = current_app.extensions['asset_manifest']
+    if path in manifest:
+        return url_for('assets', filename=manifest[path])
+    return url_for('static', filename=path)
+
+def serve_asset(filename: str):
+    """Serve a fingerprinted asset, precompressed when the client accepts it"""
+    if filename not in current_app.extensions['asset_files']:
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for token, suffix in ENCODINGS:
+        if request.accept_encodings[token] and os.path.exists(os.path.join(DIST_DIR, filename + suffix)):
+            encoding = (token, suffix)
+            break
+
+    response = send_from_directory(DIST_DIR, filename + (encoding[1] if encoding else ''), mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding[0]
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
+def init_assets(app):
+    """Load the asset manifest and register the /assets route and asset_url template helper"""
+    manifest = load_manifest()
+    app.extensions['asset_manifest'] = manifest
+    app.extensions['asset_files'] = set(manifest.values())
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.jinja_env.globals['asset_url'] = asset_url
+    if not manifest:
+        app.logger.warning("No asset manifest found; serving unbuilt static files. Run python build_assets.py")
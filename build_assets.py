@@ -0,0 +1,160 @@
+"""
+Build fingerprinted, precompressed static assets.
+
+    python build_assets.py          # verify vendor files, then build
+    python build_assets.py --fetch  # download missing vendor files first
+
+Files under static/css, static/js and static/vendor are copied to
+static/dist with a content hash in their name, alongside .gz and .br
+(Brotli) variants, and listed in
+static/dist/manifest.json for templates to reference via asset_url().
+Vendor files are committed under static/vendor and checked against the
+sha256 pinned in VENDOR; the build exits non-zero if any is missing or
+differs. To upgrade one, change its URL and hash, delete the old file and
+run with --fetch.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import urllib.request
+
+from assets import STATIC_DIR, DIST_DIR, MANIFEST_PATH
+
+try:
+    import brotli
+except ImportError:
+    # Reported when the script runs so the module can still be imported without it
+    brotli = None
+
+SOURCE_DIRS = ['css', 'js', 'vendor']
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.map')
+# Skip compressing tiny files where the headers outweigh the savings
+MIN_COMPRESS_SIZE = 512
+
+# Trailing //# or /*# sourceMappingURL=... */ comment left by upstream minifiers
+SOURCE_MAP_RE = re.compile(rb'\n?/[/*]# sourceMappingURL=(\S+?)(?: \*/)?\s*$')
+
+# Third-party assets served from static/vendor: (upstream URL, sha256 of the committed file)
+VENDOR = {
+    'vendor/bootstrap.min.css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.8/dist/css/bootstrap.min.css',
+        'd85327d99c7a3ee1f9b5d0500d1370acea3ad2db39c163c2f51f232baedbdede'),
+    'vendor/bootstrap.bundle.min.js': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.8/dist/js/bootstrap.bundle.min.js',
+        'e4fd49181388c48ec5040bd3fe66f57c29c8e67fcd8502b3354b96ec7ab47cc7'),
+    'vendor/chart.umd.js': (
+        'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.js',
+        '321e3a3fa98da4aaa957d10be57cbb514de0989eed8f9d726b5d05902cd01904')
+}
+
+def fetch_vendor() -> None:
+    """Download vendor files that are not present in static/vendor"""
+    for path, (url, _) in VENDOR.items():
+        target = os.path.join(STATIC_DIR, path)
+        if os.path.exists(target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        print(f"Fetching {url}")
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                content = response.read()
+        except OSError as e:
+            print(f"Could not fetch {path}: {e}")
+            continue
+        with open(target, 'wb') as f:
+            f.write(content)
+
+def verify_vendor() -> list:
+    """Errors for vendor files that are missing or do not match their pinned hash"""
+    errors = []
+    for path, (_, sha256) in VENDOR.items():
+        source = os.path.join(STATIC_DIR, path)
+        if not os.path.exists(source):
+            errors.append(f"{path} is missing; run python build_assets.py --fetch")
+            continue
+        with open(source, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if digest != sha256:
+            errors.append(f"{path} has sha256 {digest}, expected {sha256}")
+    return errors
+
+def strip_missing_source_map(source: str, content: bytes) -> bytes:
+    """Drop a sourceMappingURL comment whose map is not shipped, so browsers do not request it"""
+    match = SOURCE_MAP_RE.search(content)
+    if not match:
+        return content
+    map_path = os.path.join(os.path.dirname(source), match.group(1).decode())
+    if os.path.exists(map_path):
+        return content
+    return content[:match.start()] + b'\n'
+
+def fingerprinted_name(path: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, ext = os.path.splitext(path)
+    if stem.endswith('.min'):
+        # Keep the .min marker next to the extension: bootstrap.bundle.<hash>.min.js
+        return f"{stem[:-4]}.{digest}.min{ext}"
+    return f"{stem}.{digest}{ext}"
+
+def write_compressed(path: str, content: bytes) -> None:
+    """Write .gz and .br variants when they are smaller than the original"""
+    if not path.endswith(COMPRESSIBLE) or len(content) < MIN_COMPRESS_SIZE:
+        return
+    # mtime=0 keeps the gzip output identical across builds
+    gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(gzipped) < len(content):
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzipped)
+    if brotli is not None:
+        compressed = brotli.compress(content, quality=11)
+        if len(compressed) < len(content):
+            with open(path + '.br', 'wb') as f:
+                f.write(compressed)
+
+def build() -> dict:
+    """Rebuild static/dist from scratch and return the manifest"""
+    if os.path.exists(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    manifest = {}
+    for source_dir in SOURCE_DIRS:
+        for root, _, files in os.walk(os.path.join(STATIC_DIR, source_dir)):
+            for name in sorted(files):
+                source = os.path.join(root, name)
+                path = os.path.relpath(source, STATIC_DIR).replace(os.sep, '/')
+                with open(source, 'rb') as f:
+                    content = strip_missing_source_map(source, f.read())
+                built = fingerprinted_name(path, content)
+                target = os.path.join(DIST_DIR, built)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f:
+                    f.write(content)
+                write_compressed(target, content)
+                manifest[path] = built
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets.')
+    parser.add_argument('--fetch', action='store_true', help='Download missing vendor files before building.')
+    args = parser.parse_args()
+
+    if args.fetch:
+        fetch_vendor()
+    errors = verify_vendor()
+    if errors:
+        for error in errors:
+            print(f"Error: {error}", file=sys.stderr)
+        sys.exit(1)
+    if brotli is None:
+        print("Error: brotli is not installed; run uv sync (or pip install brotli)", file=sys.stderr)
+        sys.exit(1)
+
+    manifest = build()
+    print(f"Built {len(manifest)} asset(s) into {os.path.relpath(DIST_DIR)}")
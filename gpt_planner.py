@@ -1,33 +1,27 @@
 import os
+import re
+import time
 import openai
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 
-# Initialize OpenAI client
+# Initialize OpenAI clients
 client = openai.OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+async_client = openai.AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
 
-def generate_improved_plan(analysis: Dict[str, Any]) -> str:
-    """Generate an improved implementation plan using OpenAI GPT-4"""
-    
-    # Create a detailed prompt for GPT based on the analysis
-    modules_list = ', '.join(analysis['modules'])
-    technical_reqs = '\n'.join([f"- {req}" for req in analysis['technical_requirements']]) if analysis['technical_requirements'] else 'No specific technical requirements'
-    
-    # Calculate estimated timeline based on complexity
-    base_weeks = {'low': 8, 'medium': 12, 'high': 16}
-    estimated_weeks = base_weeks.get(analysis['complexity'].lower(), 12)
-    
-    prompt = f"""As an Odoo ERP implementation expert, create a detailed implementation plan for:
+PLAN_MODEL = "gpt-4"
+# Bump whenever SYSTEM_PROMPT, PLAN_INSTRUCTIONS or build_plan_prompt change
+# so stale plans can be found and regenerated
+PROMPT_VERSION = "2"
 
-Project Scope:
-- Modules to implement: {modules_list}
-- Project Complexity: {analysis['complexity']}
-- Estimated Duration: {estimated_weeks} weeks
+# Token budgets for plan generation (overridable via environment)
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PLAN_PROMPT_TOKEN_BUDGET', 1500))
+MIN_COMPLETION_TOKENS = 1200
+MAX_COMPLETION_TOKENS = int(os.environ.get('PLAN_MAX_COMPLETION_TOKENS', 3500))
 
-Technical Requirements:
-{technical_reqs}
+SYSTEM_PROMPT = "You are an expert Odoo ERP implementation consultant with extensive experience in planning and executing complex ERP projects. Focus on providing practical, actionable implementation plans with precise timelines and clear deliverables."
 
-Please provide a comprehensive implementation plan including:
+PLAN_INSTRUCTIONS = """Please provide a comprehensive implementation plan including:
 
 1. Project Overview:
    - Total duration with exact timeline
@@ -59,31 +53,186 @@ Please provide a comprehensive implementation plan including:
 
 Format the response using Markdown with clear headings, bullet points, and proper sectioning."""
 
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token for English text)"""
+    if not text:
+        return 0
+    return max(1, (len(text) + 3) // 4)
+
+def _normalize(item: str) -> str:
+    return re.sub(r'\s+', ' ', item).strip()
+
+def _words(item: str) -> frozenset:
+    """Lowercased words with surrounding punctuation removed, keeping symbols such as C++ or C#"""
+    words = (word.strip('.,;:!?()[]"\'') for word in item.lower().split())
+    return frozenset(word for word in words if word)
+
+def compact_items(items: List[str], drop_subsumed: bool = True) -> List[str]:
+    """
+    Collapse whitespace and drop empty, duplicate or subsumed entries, keeping
+    order. An entry is subsumed when its words are a subset of another entry's words
+    """
+    compacted = []
+    seen = []
+    for item in items:
+        item = _normalize(item)
+        words = _words(item)
+        if not words:
+            continue
+        if words in seen or (drop_subsumed and any(words <= existing for existing in seen)):
+            continue
+        # A longer item replaces any earlier entries whose words it fully contains
+        for i in reversed(range(len(seen))):
+            if drop_subsumed and seen[i] <= words:
+                del seen[i]
+                del compacted[i]
+        seen.append(words)
+        compacted.append(item)
+    return compacted
+
+def _fit_items(items: List[str], budget: int) -> List[str]:
+    """Take bullet items in order until the token budget is used up"""
+    lines = []
+    used = 0
+    for item in items:
+        line = f"- {item}"
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            # Truncate the first item that does not fit if there is room for a useful fragment
+            remaining_chars = (budget - used - 1) * 4
+            if not lines and remaining_chars > 40:
+                lines.append(f"- {item[:remaining_chars - 5].rstrip()}...")
+            omitted = len(items) - len(lines)
+            if omitted:
+                lines.append(f"- (+{omitted} more not shown)")
+            break
+        lines.append(line)
+        used += cost
+    return lines
+
+def estimate_weeks(analysis: Dict[str, Any]) -> int:
+    """Estimated timeline in weeks based on complexity"""
+    base_weeks = {'low': 8, 'medium': 12, 'high': 16}
+    return base_weeks.get(analysis['complexity'].lower(), 12)
+
+def completion_token_limit(analysis: Dict[str, Any]) -> int:
+    """Size the completion budget by project complexity and number of modules"""
+    base_tokens = {'low': 1200, 'medium': 1800, 'high': 2400}
+    tokens = base_tokens.get(analysis['complexity'].lower(), 1800)
+    tokens += 150 * max(0, len(compact_items(analysis['modules'], drop_subsumed=False)) - 1)
+    return max(MIN_COMPLETION_TOKENS, min(MAX_COMPLETION_TOKENS, tokens))
+
+def build_plan_prompt(analysis: Dict[str, Any], token_budget: Optional[int] = None) -> str:
+    """
+    Build the plan prompt, deduplicating inputs and compacting them so the
+    whole prompt (including the system message) stays within token_budget
+    """
+    if token_budget is None:
+        token_budget = PROMPT_TOKEN_BUDGET
+
+    modules = compact_items(analysis['modules'], drop_subsumed=False)
+    features = compact_items(analysis.get('key_features', []))
+    technical = compact_items(analysis.get('technical_requirements', []))
+
+    header = f"""As an Odoo ERP implementation expert, create a detailed implementation plan for:
+
+Project Scope:
+- Modules to implement: {', '.join(modules)}
+- Project Complexity: {analysis['complexity']}
+- Estimated Duration: {estimate_weeks(analysis)} weeks"""
+
+    fixed_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(header) + estimate_tokens(PLAN_INSTRUCTIONS)
+    # Allow for section titles and message framing
+    available = max(0, token_budget - fixed_tokens - 20)
+
+    # Split what is left between features and technical requirements by their
+    # size, giving any unused share of one to the other
+    feature_tokens = sum(estimate_tokens(f"- {f}") + 1 for f in features)
+    technical_tokens = sum(estimate_tokens(f"- {t}") + 1 for t in technical)
+    if feature_tokens + technical_tokens <= available:
+        feature_budget, technical_budget = feature_tokens, technical_tokens
+    else:
+        half = available // 2
+        feature_budget = min(feature_tokens, max(half, available - technical_tokens))
+        technical_budget = available - feature_budget
+
+    feature_lines = _fit_items(features, feature_budget) or ['No specific key features']
+    technical_lines = _fit_items(technical, technical_budget) or ['No specific technical requirements']
+
+    return '\n\n'.join([
+        header,
+        "Key Features:\n" + '\n'.join(feature_lines),
+        "Technical Requirements:\n" + '\n'.join(technical_lines),
+        PLAN_INSTRUCTIONS
+    ])
+
+def _completion_kwargs(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Request parameters for a plan completion"""
+    return {
+        'model': PLAN_MODEL,
+        'messages': [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": build_plan_prompt(analysis)}
+        ],
+        'max_tokens': completion_token_limit(analysis),
+        'temperature': 0.7,
+        'presence_penalty': 0.3,
+        'frequency_penalty': 0.3
+    }
+
+def _finish_plan(response: Any, kwargs: Dict[str, Any], latency_ms: int, usage: Optional[Dict[str, Any]]) -> str:
+    """Extract the plan from a completion and record its usage"""
+    plan = response.choices[0].message.content.strip()
+    model = getattr(response, 'model', None) or kwargs['model']
+
+    if usage is not None:
+        response_usage = getattr(response, 'usage', None)
+        prompt_text = ''.join(message['content'] for message in kwargs['messages'])
+        usage.update({
+            'model': model,
+            'prompt_version': PROMPT_VERSION,
+            'prompt_tokens': getattr(response_usage, 'prompt_tokens', None) or estimate_tokens(prompt_text),
+            'completion_tokens': getattr(response_usage, 'completion_tokens', None) or estimate_tokens(plan),
+            'max_tokens': kwargs['max_tokens'],
+            'latency_ms': latency_ms
+        })
+
+    # Add timestamp and version info
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M UTC")
+    return f"Plan Generated: {timestamp}\nVersion: {model} (prompt v{PROMPT_VERSION})\n\n{plan}"
+
+def generate_improved_plan(analysis: Dict[str, Any], usage: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Generate an improved implementation plan using OpenAI GPT-4
+
+    If a usage dict is passed it is filled with the model, prompt version,
+    token counts and latency of the request so callers can record them.
+    """
+    kwargs = _completion_kwargs(analysis)
+
     try:
         # Call OpenAI API with enhanced parameters
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an expert Odoo ERP implementation consultant with extensive experience in planning and executing complex ERP projects. Focus on providing practical, actionable implementation plans with precise timelines and clear deliverables."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=2500,
-            temperature=0.7,
-            presence_penalty=0.3,
-            frequency_penalty=0.3
-        )
-        
-        # Extract and return the generated plan
-        plan = response.choices[0].message.content.strip()
-        
-        # Add timestamp and version info
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M UTC")
-        plan = f"Plan Generated: {timestamp}\nVersion: GPT-4 Enhanced\n\n{plan}"
-        
-        return plan
-        
+        started = time.perf_counter()
+        response = client.chat.completions.create(**kwargs)
+        latency_ms = int((time.perf_counter() - started) * 1000)
+
+        return _finish_plan(response, kwargs, latency_ms, usage)
+
     except Exception as e:
         print(f"Error generating plan with GPT-4: {str(e)}")
         # Fallback to basic plan generation
         from plan_generator import generate_basic_plan
+        if usage is not None:
+            usage.clear()
         return generate_basic_plan(analysis)
+
+async def generate_improved_plan_async(analysis: Dict[str, Any], usage: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Async variant of generate_improved_plan for batch regeneration.
+    Errors are raised rather than falling back to the basic plan.
+    """
+    kwargs = _completion_kwargs(analysis)
+    started = time.perf_counter()
+    response = await async_client.chat.completions.create(**kwargs)
+    latency_ms = int((time.perf_counter() - started) * 1000)
+    return _finish_plan(response, kwargs, latency_ms, usage)
@@ -1,9 +1,14 @@
+import os
 from flask_login import UserMixin
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
+from plan_parser import parse_plan
 
 db = SQLAlchemy()
 
+# A plan still 'generating' after this long was abandoned (worker killed or timed out)
+GENERATION_TIMEOUT = timedelta(minutes=int(os.environ.get('PLAN_GENERATION_TIMEOUT_MINUTES', 10)))
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -22,6 +27,15 @@ class Requirement(db.Model):
     functional_requirements = db.Column(db.Text, nullable=False)
     technical_constraints = db.Column(db.Text)
     implementation_plan = db.Column(db.Text)
+    plan_model = db.Column(db.String(50))
+    plan_prompt_version = db.Column(db.String(20), index=True)
+    plan_prompt_tokens = db.Column(db.Integer)
+    plan_completion_tokens = db.Column(db.Integer)
+    plan_max_tokens = db.Column(db.Integer)
+    plan_latency_ms = db.Column(db.Integer)
+    generation_status = db.Column(db.String(20), default='ready')
+    generation_started_at = db.Column(db.DateTime)
+    idempotency_key = db.Column(db.String(64), unique=True, index=True)
     status = db.Column(db.String(20), default='pending')
     complexity = db.Column(db.String(20), default='medium')
     overall_progress = db.Column(db.Integer, default=0)
@@ -33,6 +47,75 @@ class Requirement(db.Model):
     })
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     comments = db.relationship('Comment', backref='requirement', lazy=True, cascade='all, delete-orphan')
+    plan_versions = db.relationship('PlanVersion', backref='requirement', lazy='dynamic',
+                                    cascade='all, delete-orphan', order_by='PlanVersion.created_at.desc()')
+    plan_sections = db.relationship('PlanSection', backref='requirement', lazy=True,
+                                    cascade='all, delete-orphan', order_by='PlanSection.position')
+    plan_phases = db.relationship('PlanPhase', backref='requirement', lazy=True,
+                                  cascade='all, delete-orphan', order_by='PlanPhase.position')
+
+    @property
+    def generation_state(self):
+        """'generating', 'failed' or 'ready', treating abandoned generations as failed"""
+        if self.generation_status == 'generating':
+            if self.generation_started_at is None or datetime.utcnow() - self.generation_started_at > GENERATION_TIMEOUT:
+                return 'failed'
+        return self.generation_status or 'ready'
+
+    @classmethod
+    def generation_failed_clause(cls):
+        """SQL condition matching requirements whose generation_state is 'failed'"""
+        return db.or_(cls.generation_status == 'failed',
+                      db.and_(cls.generation_status == 'generating',
+                              db.or_(cls.generation_started_at.is_(None),
+                                     cls.generation_started_at < datetime.utcnow() - GENERATION_TIMEOUT)))
+
+    @classmethod
+    def generation_idle_clause(cls):
+        """SQL condition matching requirements with no generation in progress"""
+        return db.or_(cls.generation_status.is_(None), cls.generation_status != 'generating',
+                      cls.generation_failed_clause())
+
+    def apply_plan(self, plan, usage):
+        """Set the current plan and store it as a new PlanVersion"""
+        if self.implementation_plan and self.plan_versions.count() == 0:
+            # Keep plans generated before versioning so they can still be compared
+            self.plan_versions.append(PlanVersion(
+                content=self.implementation_plan,
+                created_at=self.created_at,
+                prompt_version=self.plan_prompt_version,
+                model=self.plan_model or 'legacy',
+                prompt_tokens=self.plan_prompt_tokens,
+                completion_tokens=self.plan_completion_tokens,
+                max_tokens=self.plan_max_tokens,
+                latency_ms=self.plan_latency_ms
+            ))
+        self.implementation_plan = plan
+        self.generation_status = 'ready'
+        self.plan_model = usage.get('model')
+        self.plan_prompt_version = usage.get('prompt_version')
+        self.plan_prompt_tokens = usage.get('prompt_tokens')
+        self.plan_completion_tokens = usage.get('completion_tokens')
+        self.plan_max_tokens = usage.get('max_tokens')
+        self.plan_latency_ms = usage.get('latency_ms')
+        version = PlanVersion(
+            content=plan,
+            prompt_version=self.plan_prompt_version,
+            model=self.plan_model or 'basic',
+            prompt_tokens=self.plan_prompt_tokens,
+            completion_tokens=self.plan_completion_tokens,
+            max_tokens=self.plan_max_tokens,
+            latency_ms=self.plan_latency_ms
+        )
+        self.plan_versions.append(version)
+        self.index_plan()
+        return version
+
+    def index_plan(self):
+        """Replace the structured sections and phases with those parsed from the current plan"""
+        parsed = parse_plan(self.implementation_plan)
+        self.plan_sections = [PlanSection(**section) for section in parsed['sections']]
+        self.plan_phases = [PlanPhase(**phase) for phase in parsed['phases']]
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -40,3 +123,84 @@ class Comment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     requirement_id = db.Column(db.Integer, db.ForeignKey('requirement.id'), nullable=False)
+
+class PlanVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    requirement_id = db.Column(db.Integer, db.ForeignKey('requirement.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Loaded only when a single version is viewed, not for the history table
+    content = db.deferred(db.Column(db.Text, nullable=False))
+    prompt_version = db.Column(db.String(20))
+    model = db.Column(db.String(50), nullable=False)
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    max_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+
+class PlanSection(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    requirement_id = db.Column(db.Integer, db.ForeignKey('requirement.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    kind = db.Column(db.String(20), nullable=False, default='section', index=True)
+    # Loaded only when a section is expanded
+    content = db.deferred(db.Column(db.Text, nullable=False))
+    items = db.Column(db.JSON, default=list)
+
+class PlanPhase(db.Model):
+    __table_args__ = (
+        db.Index('ix_plan_phase_key_duration', 'phase_key', 'duration_weeks'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    requirement_id = db.Column(db.Integer, db.ForeignKey('requirement.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    phase_key = db.Column(db.String(30), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    duration_weeks = db.Column(db.Float)
+    tasks = db.Column(db.JSON, default=list)
+
+class RateLimitBucket(db.Model):
+    key = db.Column(db.String(128), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+# Columns added to the requirement table after it was first deployed, with the
+# SQL default for existing rows. db.create_all() never alters an existing table.
+REQUIREMENT_UPGRADES = {
+    'plan_model': None,
+    'plan_prompt_version': None,
+    'plan_prompt_tokens': None,
+    'plan_completion_tokens': None,
+    'plan_max_tokens': None,
+    'plan_latency_ms': None,
+    # Generation status and idempotency of plan requests
+    'generation_status': "'ready'",
+    'generation_started_at': None,
+    'idempotency_key': None
+}
+
+def upgrade_schema():
+    """Add missing requirement columns and their indexes. Safe to run on every startup."""
+    dialect = db.engine.dialect
+    table = Requirement.__table__
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns(table.name)}
+    # Postgres can skip columns another worker added concurrently
+    if_not_exists = 'IF NOT EXISTS ' if dialect.name == 'postgresql' else ''
+
+    with db.engine.begin() as connection:
+        for name, default in REQUIREMENT_UPGRADES.items():
+            if name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{name} {table.c[name].type.compile(dialect=dialect)}"
+            if default is not None:
+                ddl += f" DEFAULT {default}"
+            connection.execute(db.text(ddl))
+
+        for index in table.indexes:
+            columns = [column.name for column in index.columns]
+            if not any(column in REQUIREMENT_UPGRADES for column in columns):
+                continue
+            unique = 'UNIQUE ' if index.unique else ''
+            connection.execute(db.text(
+                f"CREATE {unique}INDEX IF NOT EXISTS {index.name} ON {table.name} ({', '.join(columns)})"))
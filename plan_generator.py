@@ -1,16 +1,16 @@
 from gpt_planner import generate_improved_plan
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 import re
 
-def generate_plan(analysis: Dict[str, Any]) -> str:
+def generate_plan(analysis: Dict[str, Any], usage: Optional[Dict[str, Any]] = None) -> str:
     """
     Generate implementation plan based on requirements analysis using GPT
     Falls back to basic plan generation if GPT generation fails
     """
     try:
         # Always try GPT-4 first for enhanced plan generation
-        return generate_improved_plan(analysis)
+        return generate_improved_plan(analysis, usage=usage)
     except Exception as e:
         print(f"Falling back to basic plan generation: {str(e)}")
         return generate_basic_plan(analysis)
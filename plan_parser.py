@@ -0,0 +1,158 @@
+import re
+from typing import Dict, Any, List, Optional
+
+PHASE_KEYWORDS = [
+    ('initial_setup', ('initial setup', 'setup', 'preparation', 'discovery')),
+    ('development', ('development', 'customization')),
+    ('testing', ('testing', 'uat', 'quality assurance')),
+    ('deployment', ('deployment', 'go-live', 'go live', 'rollout'))
+]
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+BOLD_LINE_RE = re.compile(r'^\*\*(.+?)\*\*:?\s*$')
+NUMBERED_RE = re.compile(r'^\d+\.\s+(.*)$')
+BULLET_RE = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+(.*)$')
+DURATION_LINE_RE = re.compile(r'^\**\s*(?:duration|estimated duration|timeline)\s*\**\s*:', re.IGNORECASE)
+WEEK_SPAN_RE = re.compile(r'weeks?\s+(\d+)\s*(?:-|–|to)\s*(\d+)', re.IGNORECASE)
+AMOUNT_RE = re.compile(r'(\d+(?:\.\d+)?)(?:\s*(?:-|–|to)\s*(\d+(?:\.\d+)?))?\s*(weeks?|months?|days?)\b', re.IGNORECASE)
+UNIT_WEEKS = {'week': 1, 'month': 4.33, 'day': 0.2}
+
+def _clean(text: str) -> str:
+    """Strip Markdown emphasis and trailing punctuation from a title or item"""
+    return re.sub(r'[*_`]', '', text).strip().rstrip(':').strip()
+
+def parse_duration_weeks(text: str) -> Optional[float]:
+    """
+    Duration in weeks mentioned in text. A span of week numbers counts the
+    weeks it covers ('Weeks 3-6' is 4); an amount uses the upper bound of a
+    range ('2-3 months' is 13)
+    """
+    span = WEEK_SPAN_RE.search(text)
+    if span:
+        return float(int(span.group(2)) - int(span.group(1)) + 1)
+    amount = AMOUNT_RE.search(text)
+    if amount:
+        value = float(amount.group(2) or amount.group(1))
+        unit = amount.group(3).lower().rstrip('s')
+        return round(value * UNIT_WEEKS[unit], 1)
+    return None
+
+def phase_key(title: str) -> Optional[str]:
+    """Map a heading such as 'Testing Phase (3 weeks)' to its phase key"""
+    lowered = _clean(title).lower()
+    for key, keywords in PHASE_KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return key
+    return None
+
+def _blocks(lines: List[str]) -> List[Dict[str, Any]]:
+    """Split lines at headings, bold-only lines and unindented numbered items"""
+    blocks = [{'title': None, 'heading_level': None, 'lines': []}]
+    for line in lines:
+        stripped = line.strip()
+        heading = HEADING_RE.match(stripped)
+        if heading:
+            blocks.append({'title': heading.group(2), 'heading_level': len(heading.group(1)), 'lines': []})
+            continue
+        bold = BOLD_LINE_RE.match(stripped)
+        numbered = NUMBERED_RE.match(line)
+        if bold or numbered:
+            blocks.append({'title': (bold or numbered).group(1), 'heading_level': None, 'lines': []})
+            continue
+        blocks[-1]['lines'].append(line)
+    return blocks
+
+def _items(lines: List[str]) -> List[str]:
+    """Bullet items, skipping label-only bullets like '**Tasks:**'"""
+    items = []
+    for line in lines:
+        bullet = BULLET_RE.match(line)
+        if not bullet:
+            continue
+        text = bullet.group(1).strip()
+        if text.endswith(':') or text.endswith(':**'):
+            continue
+        text = _clean(text)
+        if text:
+            items.append(text)
+    return items
+
+def _phases(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """One entry per phase key, taken from the block with the most tasks"""
+    phases = {}
+    durations = {}
+    for block in blocks:
+        if not block['title']:
+            continue
+        key = phase_key(block['title'])
+        if not key:
+            continue
+
+        duration = None
+        for line in block['lines']:
+            if DURATION_LINE_RE.match(BULLET_RE.sub(r'\1', line).strip()):
+                duration = parse_duration_weeks(line)
+                if duration:
+                    break
+        if duration is None:
+            duration = parse_duration_weeks(block['title'])
+        if duration is not None:
+            durations.setdefault(key, duration)
+
+        tasks = [item for item in _items(block['lines'])
+                 if not DURATION_LINE_RE.match(item) and not item.lower().startswith('timeline')]
+        if key not in phases or len(tasks) > len(phases[key]['tasks']):
+            phases[key] = {'phase_key': key, 'title': _clean(block['title'])[:200],
+                           'duration_weeks': duration, 'tasks': tasks}
+
+    ordered = []
+    for position, (key, _) in enumerate(PHASE_KEYWORDS):
+        if key in phases:
+            phase = phases[key]
+            if phase['duration_weeks'] is None:
+                phase['duration_weeks'] = durations.get(key)
+            phase['position'] = position
+            ordered.append(phase)
+    return ordered
+
+def parse_plan(plan: str) -> Dict[str, Any]:
+    """
+    Parse a Markdown plan into top-level sections (for display), phases with
+    their tasks and durations, and risks
+    """
+    lines = (plan or '').splitlines()
+    blocks = _blocks(lines)
+
+    # Display sections split at the highest heading level used more than once,
+    # so a single document title does not swallow the whole plan
+    levels = sorted(block['heading_level'] for block in blocks if block['heading_level'])
+    top_level = levels[0] if levels else None
+    while top_level and levels.count(top_level) == 1 and any(level > top_level for level in levels):
+        top_level = min(level for level in levels if level > top_level)
+    sections = []
+    current = None
+    for line in lines:
+        heading = HEADING_RE.match(line.strip())
+        if heading and len(heading.group(1)) == top_level:
+            current = {'title': _clean(heading.group(2)), 'lines': []}
+            sections.append(current)
+            continue
+        if current is None:
+            current = {'title': 'Summary', 'lines': []}
+            sections.append(current)
+        current['lines'].append(line)
+
+    parsed_sections = []
+    risks = []
+    for section in sections:
+        content = '\n'.join(section['lines']).strip('\n')
+        if not content.strip() and section['title'] == 'Summary':
+            continue
+        kind = 'risks' if 'risk' in section['title'].lower() else 'section'
+        items = _items(section['lines'])
+        if kind == 'risks':
+            risks.extend(items)
+        parsed_sections.append({'position': len(parsed_sections), 'title': section['title'][:200],
+                                'kind': kind, 'content': content, 'items': items})
+
+    return {'sections': parsed_sections, 'phases': _phases(blocks), 'risks': risks}
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from models import db, Requirement
+from requirements_analyzer import analyze_requirements
+from gpt_planner import generate_improved_plan_async, PLAN_MODEL, PROMPT_VERSION
+
+def select_requirements(stale_only: bool = True, user_id: Optional[int] = None,
+                        complexity: Optional[str] = None, since: Optional[datetime] = None,
+                        ids: Optional[List[int]] = None, limit: Optional[int] = None) -> List[Requirement]:
+    """Requirements whose plans should be regenerated"""
+    # Skip plans being generated right now, but include failed and abandoned ones
+    query = Requirement.query.filter(Requirement.generation_idle_clause())
+    if stale_only:
+        query = query.filter(db.or_(Requirement.plan_prompt_version.is_(None),
+                                    Requirement.plan_prompt_version != PROMPT_VERSION,
+                                    Requirement.plan_model.is_(None),
+                                    Requirement.plan_model != PLAN_MODEL))
+    if user_id is not None:
+        query = query.filter(Requirement.user_id == user_id)
+    if complexity:
+        query = query.filter(Requirement.complexity == complexity)
+    if since:
+        query = query.filter(Requirement.created_at >= since)
+    if ids:
+        query = query.filter(Requirement.id.in_(ids))
+    query = query.order_by(Requirement.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """Load a checkpoint, ignoring it if it was written for another prompt version or model"""
+    empty = {'prompt_version': PROMPT_VERSION, 'model': PLAN_MODEL, 'completed': [], 'failed': {}}
+    if not os.path.exists(path):
+        return empty
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('prompt_version') != PROMPT_VERSION or checkpoint.get('model') != PLAN_MODEL:
+        return empty
+    return checkpoint
+
+def claim_requirement(requirement: Requirement) -> bool:
+    """
+    Mark the requirement as generating unless a generation is already in
+    progress (e.g. a retry from the web form); returns whether it was claimed
+    """
+    claimed = (Requirement.query.filter_by(id=requirement.id)
+               .filter(Requirement.generation_idle_clause())
+               .update({'generation_status': 'generating', 'generation_started_at': datetime.utcnow()},
+                       synchronize_session=False))
+    db.session.commit()
+    return bool(claimed)
+
+def release_requirement(requirement: Requirement, status: str) -> None:
+    """Put back the status a claimed requirement had before a failed regeneration"""
+    db.session.rollback()
+    (Requirement.query.filter_by(id=requirement.id, generation_status='generating')
+     .update({'generation_status': status}, synchronize_session=False))
+    db.session.commit()
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """Write the checkpoint atomically so an interrupted run never leaves it half written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+async def _regenerate_all(requirements: List[Requirement], concurrency: int,
+                          checkpoint: Dict[str, Any], checkpoint_path: str, log) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    completed = set(checkpoint['completed'])
+
+    async def regenerate(requirement: Requirement) -> None:
+        analysis = analyze_requirements(requirement)
+        usage = {}
+        async with semaphore:
+            # Claim the row only once a slot is free so queued rows do not run into the generation timeout
+            previous_status = requirement.generation_state
+            if not claim_requirement(requirement):
+                log(f"Requirement {requirement.id}: skipped (already being generated)")
+                return
+            try:
+                plan = await generate_improved_plan_async(analysis, usage=usage)
+            except Exception as e:
+                release_requirement(requirement, previous_status)
+                checkpoint['failed'][str(requirement.id)] = str(e)
+                save_checkpoint(checkpoint_path, checkpoint)
+                log(f"Requirement {requirement.id}: failed ({e})")
+                return
+
+        # Database writes run on the event loop thread, one requirement at a time
+        try:
+            requirement.complexity = analysis['complexity']
+            requirement.apply_plan(plan, usage)
+            db.session.commit()
+        except Exception as e:
+            release_requirement(requirement, previous_status)
+            checkpoint['failed'][str(requirement.id)] = str(e)
+            save_checkpoint(checkpoint_path, checkpoint)
+            log(f"Requirement {requirement.id}: could not be saved ({e})")
+            return
+
+        completed.add(requirement.id)
+        checkpoint['completed'] = sorted(completed)
+        checkpoint['failed'].pop(str(requirement.id), None)
+        save_checkpoint(checkpoint_path, checkpoint)
+        log(f"Requirement {requirement.id}: regenerated ({usage.get('completion_tokens')} tokens)")
+
+    await asyncio.gather(*(regenerate(requirement) for requirement in requirements))
+
+def regenerate_plans(requirements: List[Requirement], concurrency: int = 4,
+                     checkpoint_path: str = 'regenerate_plans.checkpoint.json', log=print) -> Dict[str, Any]:
+    """
+    Regenerate plans for the given requirements with at most `concurrency`
+    GPT calls in flight, skipping any already completed in the checkpoint.
+    The checkpoint is kept only while failures remain to be retried.
+    Returns the final checkpoint.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    done = set(checkpoint['completed'])
+    pending = [requirement for requirement in requirements if requirement.id not in done]
+    log(f"{len(pending)} to regenerate, {len(requirements) - len(pending)} already done "
+        f"(prompt v{PROMPT_VERSION}, {PLAN_MODEL})")
+    if pending:
+        asyncio.run(_regenerate_all(pending, max(1, concurrency), checkpoint, checkpoint_path, log))
+    # A clean run needs no resuming; start the next run from scratch
+    if not checkpoint['failed'] and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return checkpoint
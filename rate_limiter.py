@@ -0,0 +1,115 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Dict, Tuple, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, RateLimitBucket
+
+class RateLimitStore(ABC):
+    """
+    Shared state for token buckets. Implementations must make take() atomic
+    for a given key across every worker that shares the store.
+    """
+
+    @abstractmethod
+    def take(self, key: str, capacity: int, refill_per_second: float, cost: float = 1) -> float:
+        """
+        Remove `cost` tokens from the bucket at `key` if it has enough.
+        Returns 0 if admitted, otherwise the seconds until enough tokens refill.
+        A negative cost returns tokens to the bucket.
+        """
+
+def _refill(tokens: float, updated_at: float, now: float, capacity: int, refill_per_second: float) -> float:
+    return min(capacity, tokens + (now - updated_at) * refill_per_second)
+
+def _consume(tokens: float, capacity: int, refill_per_second: float, cost: float) -> Tuple[float, float]:
+    """Returns the new token count and the retry-after delay (0 if admitted)"""
+    if cost <= tokens:
+        return min(capacity, tokens - cost), 0
+    return tokens, (cost - tokens) / refill_per_second
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Per-process buckets; only suitable for a single worker"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = Lock()
+
+    def take(self, key: str, capacity: int, refill_per_second: float, cost: float = 1) -> float:
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated_at, now, capacity, refill_per_second)
+            tokens, retry_after = _consume(tokens, capacity, refill_per_second, cost)
+            self._buckets[key] = (tokens, now)
+        return retry_after
+
+class DatabaseRateLimitStore(RateLimitStore):
+    """Buckets stored in the application database, shared by all workers"""
+
+    def _locked_bucket(self, key: str, capacity: int, now: float) -> RateLimitBucket:
+        """Fetch the bucket row with a row lock, creating it first if needed"""
+        query = db.session.query(RateLimitBucket).filter_by(key=key).with_for_update()
+        bucket = query.first()
+        if bucket is None:
+            # SELECT ... FOR UPDATE locks nothing when the row is missing, so two first
+            # requests can both get here; the loser's insert fails and it locks the winner's row
+            try:
+                with db.session.begin_nested():
+                    db.session.add(RateLimitBucket(key=key, tokens=capacity, updated_at=now))
+            except IntegrityError:
+                pass
+            bucket = query.populate_existing().first()
+        return bucket
+
+    def take(self, key: str, capacity: int, refill_per_second: float, cost: float = 1) -> float:
+        now = time.time()
+        try:
+            bucket = self._locked_bucket(key, capacity, now)
+            tokens = _refill(bucket.tokens, bucket.updated_at, now, capacity, refill_per_second)
+            bucket.tokens, retry_after = _consume(tokens, capacity, refill_per_second, cost)
+            bucket.updated_at = now
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return retry_after
+
+class AdmissionController:
+    """Per-user and global token-bucket admission control"""
+
+    def __init__(self, store: RateLimitStore, user_capacity: int, user_per_minute: float,
+                 global_capacity: int, global_per_minute: float, scope: str = 'plan'):
+        self.store = store
+        self.user_capacity = user_capacity
+        self.user_rate = user_per_minute / 60
+        self.global_capacity = global_capacity
+        self.global_rate = global_per_minute / 60
+        self.scope = scope
+
+    def admit(self, user_id: int) -> Optional[int]:
+        """Returns None if the request is admitted, otherwise Retry-After in whole seconds"""
+        user_key = f"{self.scope}:user:{user_id}"
+        retry_after = self.store.take(user_key, self.user_capacity, self.user_rate)
+        if retry_after:
+            return math.ceil(retry_after)
+
+        retry_after = self.store.take(f"{self.scope}:global", self.global_capacity, self.global_rate)
+        if retry_after:
+            # Give the user back their token since the request was not served
+            self.store.take(user_key, self.user_capacity, self.user_rate, cost=-1)
+            return math.ceil(retry_after)
+        return None
+
+def create_store(backend: str) -> RateLimitStore:
+    """Build the rate-limit store named by the RATE_LIMIT_STORAGE setting"""
+    stores = {
+        'memory': MemoryRateLimitStore,
+        'database': DatabaseRateLimitStore
+    }
+    if backend not in stores:
+        raise ValueError(f"Unknown rate limit storage backend: {backend}")
+    return stores[backend]()